@@ -0,0 +1,21 @@
+from numba import njit
+
+# Streamlit re-executes the page script in a fresh module on every rerun, so the
+# JIT kernels live here, where the imported module stays loaded in sys.modules.
+
+# NaN rows must keep failing the range test, so "nnan" is deliberately left out
+MASK_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+# Serial on purpose: the tables are small, and Numba's parallel threading layers
+# are not safe when several Streamlit sessions call the kernel concurrently
+@njit(fastmath=MASK_FASTMATH, cache=True)
+def range_mask(M, cols, lo, hi, out):
+    # Only the column indices in cols are tested; the others are no-op ranges
+    for i in range(M.shape[0]):
+        ok = True
+        for j in cols:
+            v = M[i, j]
+            if not (lo[j] <= v <= hi[j]):
+                ok = False
+                break
+        out[i] = ok
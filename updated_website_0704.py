@@ -1,17 +1,33 @@
+import contextlib
+import os
+import tempfile
 import pandas as pd
 from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource, HoverTool, LabelSet
+from bokeh.models import CDSView, ColumnDataSource, HoverTool, IndexFilter, LabelSet
 import streamlit as st
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import xxhash
 from pymcdm.methods import PROMETHEE_II
-from pymcdm.helpers import rankdata
 from pymcdm.methods import TOPSIS
 from pymcdm.weights import entropy_weights
 from io import BytesIO
+from filter_kernels import range_mask
 from bokeh.palettes import Category10
 from bokeh.models import NumeralTickFormatter
 from bokeh.models import LogScale, Range1d, LinearScale
 
+# Prefer the Rust-backed calamine reader for XLSX; fall back to openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+# Range-filtered columns shared by every page
+FILTER_COLUMNS = ["Bandgap", "ESG Score", "Toxicity", "CO2 footprint max (kg/kg)"]
+
 # Custom CSS for styling
 def set_custom_style():
     st.markdown("""
@@ -37,67 +53,150 @@ def set_custom_style():
     </style>
     """, unsafe_allow_html=True)
 
+def load_database_table(xlsx_path):
+    """Load an XLSX database via a Parquet copy, rebuilt whenever the workbook is newer"""
+    parquet_path = os.path.splitext(xlsx_path)[0] + ".parquet"
+    if (not os.path.exists(parquet_path)
+            or os.path.getmtime(parquet_path) < os.path.getmtime(xlsx_path)):
+        df_original = pd.read_excel(xlsx_path, engine=EXCEL_ENGINE).iloc[:, 1:]
+        tmp_path = None
+        try:
+            # Write next to the target and swap it in, so a failed write never leaves a truncated cache
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp.parquet", dir=os.path.dirname(parquet_path) or ".")
+            os.close(fd)
+            df_original.to_parquet(tmp_path, engine="pyarrow", compression="snappy", index=False)
+            os.replace(tmp_path, parquet_path)
+        except OSError:
+            # Read-only deployment: serve the workbook contents directly
+            return df_original.reset_index(drop=True).convert_dtypes(dtype_backend="pyarrow")
+        finally:
+            if tmp_path is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+    return pd.read_parquet(parquet_path, engine="pyarrow", dtype_backend="pyarrow")
+
 # ===== CACHED FUNCTIONS =====
 @st.cache_data
 def load_final_database():
-    df_original = pd.read_excel("final_database.xlsx")
-    return df_original.iloc[:, 1:]
+    return load_database_table("final_database.xlsx")
 
 @st.cache_data
 def load_bandgap_database():
-    df1_original = pd.read_excel("bandgap_database.xlsx")
-    return df1_original.iloc[:, 1:]
+    return load_database_table("bandgap_database.xlsx")
 
-@st.cache_data
-def filter_dataframe(_df, filters, selected_names=None):
-    """Filter dataframe based on provided filters and optional names"""
-    bandgap_range = filters.get("Bandgap", (_df["Bandgap"].min(), _df["Bandgap"].max()))
-    esg_range = filters.get("ESG Score", (_df["ESG Score"].min(), _df["ESG Score"].max()))
-    toxicity_range = filters.get("Toxicity", (_df["Toxicity"].min(), _df["Toxicity"].max()))
-    co2_range = filters.get("CO2 footprint max (kg/kg)", 
-                          (_df["CO2 footprint max (kg/kg)"].min(), 
-                           _df["CO2 footprint max (kg/kg)"].max()))
-    
-    filtered = _df[
-        _df["Bandgap"].between(bandgap_range[0], bandgap_range[1], inclusive='both') &
-        _df["ESG Score"].between(esg_range[0], esg_range[1], inclusive='both') &
-        _df["Toxicity"].between(toxicity_range[0], toxicity_range[1], inclusive='both') &
-        _df["CO2 footprint max (kg/kg)"].between(co2_range[0], co2_range[1], inclusive='both')
-    ]
-    
-    if selected_names is not None:
-        filtered = filtered[filtered["Name"].isin(selected_names)]
+DATABASE_LOADERS = {
+    "final": load_final_database,
+    "bandgap": load_bandgap_database,
+}
+
+@st.cache_resource
+def load_filter_matrix(df_id):
+    """Contiguous (N, 4) float32 block of FILTER_COLUMNS, built once per database"""
+    df = DATABASE_LOADERS[df_id]()
+    return np.ascontiguousarray(df[FILTER_COLUMNS].to_numpy(dtype=np.float32, na_value=np.nan))
+
+@st.cache_resource
+def load_filter_stats(df_id):
+    """Per-column (min, max, has_nan) of the filter matrix, used to skip no-op ranges"""
+    matrix = load_filter_matrix(df_id)
+    return np.nanmin(matrix, axis=0), np.nanmax(matrix, axis=0), np.isnan(matrix).any(axis=0)
+
+@st.cache_data(max_entries=64)
+def _filter_cached(_df, df_id, filter_key, names_key):
+    matrix = load_filter_matrix(df_id)
+
+    # Columns without a filter keep their full range; NaN rows still fail the comparison
+    lo = np.full(len(FILTER_COLUMNS), -np.inf, dtype=np.float32)
+    hi = np.full(len(FILTER_COLUMNS), np.inf, dtype=np.float32)
+    for col, low, high in filter_key:
+        j = FILTER_COLUMNS.index(col)
+        lo[j], hi[j] = low, high
+
+    # A range covering the whole column only matters if it has NaN rows to drop
+    col_min, col_max, has_nan = load_filter_stats(df_id)
+    active_cols = np.flatnonzero(has_nan | (lo > col_min) | (hi < col_max)).astype(np.int64)
+
+    if len(active_cols):
+        # Reuse this session's mask buffer instead of allocating one per filter
+        mask_key = f"filter_mask_{df_id}"
+        out = st.session_state.get(mask_key)
+        if out is None or out.shape[0] != matrix.shape[0]:
+            out = st.session_state[mask_key] = np.empty(matrix.shape[0], dtype=np.bool_)
+        range_mask(matrix, active_cols, lo, hi, out)
+        filtered = _df.iloc[np.flatnonzero(out)]
+    else:
+        filtered = _df
+
+    if names_key is not None:
+        filtered = filtered[filtered["Name"].isin(names_key)]
     return filtered
 
+def filter_dataframe(df, df_id, filters, selected_names=None):
+    """Filter dataframe based on provided filters and optional names"""
+    # Normalise the arguments so equal selections always hit the same cache entry
+    filter_key = tuple(sorted(
+        (col, round(float(low), 6), round(float(high), 6))
+        for col, (low, high) in filters.items() if col in FILTER_COLUMNS
+    ))
+    names_key = None if selected_names is None else tuple(sorted(set(selected_names)))
+    return _filter_cached(df, df_id, filter_key, names_key)
+
+def matrix_fingerprint(*arrays):
+    """xxh3 digest of the dtypes, shapes and contents of the given arrays"""
+    h = xxhash.xxh3_64()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(a)
+    return h.intdigest()
+
+def rank_descending(scores):
+    """Ranks (1 = highest score) where tied scores share the best rank of their group"""
+    neg = -np.asarray(scores, dtype=np.float64)
+    return (np.searchsorted(np.sort(neg), neg, side="left") + 1).astype(np.int32)
+
+# MCDM helpers are keyed on mat_hash; the underscored arrays are not hashed by Streamlit
 @st.cache_data
-def calculate_weights(matrix, method="entropy"):
+def calculate_weights(mat_hash, _matrix, method="entropy"):
     if method == "entropy":
-        return entropy_weights(matrix)
+        return entropy_weights(_matrix)
     return None
 
 @st.cache_data
-def run_topsis(matrix, weights, criteria_types):
+def run_topsis(mat_hash, _matrix, _weights, criteria_types):
     topsis = TOPSIS()
-    return topsis(matrix, weights, criteria_types)
+    return topsis(_matrix, _weights, criteria_types)
 
 @st.cache_data
-def run_promethee(matrix, weights, criteria_types):
+def run_promethee(mat_hash, _matrix, _weights, criteria_types):
     promethee = PROMETHEE_II('usual')
-    return promethee(matrix, weights, criteria_types)
+    return promethee(_matrix, _weights, criteria_types)
 
 @st.cache_data
 def prepare_plot_data(df, x_col, y_col, log_x=False, log_y=False):
-    df_plot = df.copy()
-    if log_x:
-        df_plot[x_col] = np.log10(df_plot[x_col].clip(lower=1e-10))
-    if log_y:
-        df_plot[y_col] = np.log10(df_plot[y_col].clip(lower=1e-10))
-    return df_plot
+    data = {"Name": df["Name"].astype(str).to_numpy()}
+    for col, log in ((x_col, log_x), (y_col, log_y)):
+        # Copy only the columns that get transformed, then clip and log in place
+        values = df[col].to_numpy(dtype=np.float64, copy=log, na_value=np.nan)
+        if log:
+            np.log10(np.maximum(values, 1e-10, out=values), out=values)
+        data[col] = values
+    return data
+
+BOUND_COLUMNS = FILTER_COLUMNS + ["Production (ton)"]
+
+@st.cache_data
+def column_bounds(_df, df_id):
+    """(min, max) of each numeric filter/slider column, computed once per database"""
+    cols = [c for c in BOUND_COLUMNS if c in _df.columns]
+    a = _df[cols].to_numpy(dtype=np.float64, na_value=np.nan)
+    return {c: (float(np.nanmin(a[:, i])), float(np.nanmax(a[:, i]))) for i, c in enumerate(cols)}
 
 @st.cache_data
 def create_full_output(filtered_df, results_df, weights_df):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    # constant_memory is left off: pandas writes cells column by column, which that mode would drop
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         full_data = filtered_df.copy()
         if 'Score' in results_df.columns:
             full_data['TOPSIS_Score'] = results_df['Score']
@@ -113,10 +212,16 @@ def create_full_output(filtered_df, results_df, weights_df):
         )
     return output.getvalue()
 
+def sort_descending(df, sort_col):
+    """Sort df by sort_col (descending, missing values last) with pyarrow's sort kernel"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    order = pc.sort_indices(table, sort_keys=[(sort_col, "descending")])
+    sorted_df = table.take(order).to_pandas(types_mapper=pd.ArrowDtype)
+    # Keep the original row labels, as the pandas sort did
+    sorted_df.index = df.index.take(order.to_numpy())
+    return sorted_df
+
 def create_professional_plot(df, x_col, y_col, title, x_label, y_label, log_x=False, log_y=False):
-    # Create a copy to avoid modifying the original dataframe
-    df_plot = df.copy()
-    
     # Professional color palette
     primary_color = "#3498db"
     highlight_color = "#e74c3c"
@@ -133,17 +238,20 @@ def create_professional_plot(df, x_col, y_col, title, x_label, y_label, log_x=Fa
         height=500,
         tooltips=[("Name", "@Name")],
         toolbar_location="above",
-        sizing_mode="stretch_width"
+        sizing_mode="stretch_width",
+        output_backend="webgl"
     )
     
-    # Handle negative/zero values for log scales
-    if log_x:
-        df_plot[x_col] = df_plot[x_col].clip(lower=1e-10)
-    if log_y:
-        df_plot[y_col] = df_plot[y_col].clip(lower=1e-10)
+    # Only the plotted columns go to Bokeh; handle negative/zero values for log scales
+    data = {"Name": df["Name"].astype(str).to_numpy()}
+    for col, log in ((x_col, log_x), (y_col, log_y)):
+        values = df[col].to_numpy(dtype=np.float64, copy=log, na_value=np.nan)
+        if log:
+            np.maximum(values, 1e-10, out=values)
+        data[col] = values
     
     # Plot all points
-    source = ColumnDataSource(df_plot)
+    source = ColumnDataSource(data=data)
     p.circle(
         x=x_col,
         y=y_col,
@@ -154,27 +262,27 @@ def create_professional_plot(df, x_col, y_col, title, x_label, y_label, log_x=Fa
         legend_label="All Materials"
     )
     
-    # Highlight exactly 10 random materials
-    num_highlight = min(10, len(df_plot))
-    highlight_df = df_plot.sample(n=num_highlight, random_state=42)
-    highlight_source = ColumnDataSource(highlight_df)
-    
+    # Highlight exactly 10 random materials as a view over the main source
+    num_highlight = min(10, len(df))
+    idx = np.random.default_rng(42).choice(len(df), size=num_highlight, replace=False)
+    highlight_view = CDSView(source=source, filters=[IndexFilter(idx.tolist())])
     p.circle(
         x=x_col,
         y=y_col,
-        source=highlight_source,
+        source=source,
+        view=highlight_view,
         size=12,
         color=highlight_color,
         alpha=1.0,
         legend_label="Highlighted Materials"
     )
     
-    # Add labels to highlighted points
+    # Add labels to highlighted points (LabelSet has no view in Bokeh 2.4, so it gets its own rows)
     labels = LabelSet(
         x=x_col,
         y=y_col,
         text="Name",
-        source=highlight_source,
+        source=ColumnDataSource(data={k: v[idx] for k, v in data.items()}),
         text_font_size="10pt",
         text_color=highlight_color,
         y_offset=8,
@@ -199,6 +307,8 @@ def main():
     set_custom_style()
     df = load_final_database()
     df1 = load_bandgap_database()
+    bounds = column_bounds(df, "final")
+    production_min, production_max = bounds['Production (ton)']
     
     # Sidebar navigation
     st.sidebar.title("📊 Material Analysis")
@@ -248,9 +358,9 @@ def main():
             with cols[0]:
                 st.metric("Total Materials", len(df))
             with cols[1]:
-                st.metric("Bandgap Range", f"{df['Bandgap'].min():.1f} - {df['Bandgap'].max():.1f} eV")
+                st.metric("Bandgap Range", f"{bounds['Bandgap'][0]:.1f} - {bounds['Bandgap'][1]:.1f} eV")
             with cols[2]:
-                st.metric("Production Range", f"{df['Production (ton)'].min():.1f} - {df['Production (ton)'].max():.1f} tons")
+                st.metric("Production Range", f"{production_min:.1f} - {production_max:.1f} tons")
         
     elif selected_page == "Bandgap Analysis":
         st.title("📈 Bandgap Analysis")
@@ -307,9 +417,8 @@ def main():
         }
         
         # Process data
-        name_colors = {name: Category10[len(specified_names)][i] for i, name in enumerate(specified_names)} 
-        df1['color'] = df1['Name'].map(name_colors)
-        filtered_df = filter_dataframe(df1, filters, selected_names if selected_names else None)
+        name_colors = {name: Category10[len(specified_names)][i] for i, name in enumerate(specified_names)}
+        filtered_df = filter_dataframe(df1, "bandgap", filters, selected_names if selected_names else None)
         
         # Plot section below filters
         st.markdown("---")
@@ -326,11 +435,16 @@ def main():
                 y_axis_label=y_col,
                 width=1000,
                 height=600,
-                sizing_mode="stretch_width"
+                sizing_mode="stretch_width",
+                output_backend="webgl"
             )
             
             # Plot data
-            source = ColumnDataSource(filtered_df)
+            # Send only the plotted columns to the browser, as plain NumPy arrays
+            data = {col: filtered_df[col].to_numpy(dtype=np.float64, na_value=np.nan) for col in ("Bandgap", y_col)}
+            data["Name"] = filtered_df["Name"].astype(str).to_numpy()
+            data["color"] = filtered_df["Name"].map(name_colors).fillna("#888888").to_numpy()
+            source = ColumnDataSource(data=data)
             p.circle(
                 x="Bandgap", 
                 y=y_col, 
@@ -421,9 +535,9 @@ def main():
                 
                 production_range = st.slider(
                     "Production (tons)",
-                    float(df['Production (ton)'].min()),
-                    float(df['Production (ton)'].max()),
-                    (float(df['Production (ton)'].min()), float(df['Production (ton)'].max())),
+                    production_min,
+                    production_max,
+                    (production_min, production_max),
                     step=1.0
                 )
             
@@ -449,7 +563,7 @@ def main():
                 log_y = st.checkbox(f"Log scale Y-axis")
             
             # Apply filters and create plot
-            filtered_df = filter_dataframe(df, st.session_state.filters)
+            filtered_df = filter_dataframe(df, "final", st.session_state.filters)
             
             if not filtered_df.empty:
                 st.success(f"🔄 {len(filtered_df)} materials match current filters")
@@ -467,7 +581,7 @@ def main():
                 
                 # Data table
                 with st.expander("📋 View Data"):
-                    st.dataframe(filtered_df[[x_col, y_col, "Name"]].sort_values(y_col, ascending=False))
+                    st.dataframe(sort_descending(filtered_df[[x_col, y_col, "Name"]], y_col))
                 
                 # Download
                 st.download_button(
@@ -517,9 +631,9 @@ def main():
     
                     production_range = st.slider(
                         "Production (tons)",
-                        float(df['Production (ton)'].min()),
-                        float(df['Production (ton)'].max()),
-                        (float(df['Production (ton)'].min()), float(df['Production (ton)'].max())),
+                        production_min,
+                        production_max,
+                        (production_min, production_max),
                         step=1.0,
                         key="mcdm_production"
                     )
@@ -550,7 +664,7 @@ def main():
                     )
     
             # Get filtered data
-            filtered_df = filter_dataframe(df, st.session_state.filters)
+            filtered_df = filter_dataframe(df, "final", st.session_state.filters)
     
             if not filtered_df.empty:
                 st.success(f"🔄 {len(filtered_df)} materials available for analysis")
@@ -562,18 +676,29 @@ def main():
                     'Embodied energy max (MJ/kg)': -1, 'Water usage max (l/kg)': -1,
                     'Toxicity': -1, 'Companionality': -1
                 }
-                available_criteria = {k: v for k, v in criteria_options.items() if k in filtered_df.columns}
+                # Column list and direction array only change with the schema, so keep them per session
+                cols_key = tuple(c for c in criteria_options if c in filtered_df.columns)
+                criteria_cache = st.session_state.setdefault("criteria_cache", {})
+                if cols_key not in criteria_cache:
+                    criteria_cache[cols_key] = (
+                        list(cols_key),
+                        np.array([criteria_options[c] for c in cols_key], dtype=np.int8)
+                    )
+                criteria_cols, types_arr = criteria_cache[cols_key]
+                # One contiguous float64 decision matrix shared by weighting and ranking
+                # (float32 merges distinct reserve/production values and shifts PROMETHEE ties)
+                matrix = np.ascontiguousarray(filtered_df[criteria_cols].to_numpy(dtype=np.float64, na_value=np.nan))
     
                 # Weight assignment
                 if mcdm_method == "TOPSIS" and weighting_method == "Entropy Weighting":
-                    weights = entropy_weights(filtered_df[list(available_criteria.keys())].values)
+                    weights = calculate_weights(matrix_fingerprint(matrix), matrix)
                 else:
                     st.subheader("📊 Criteria Weights")
                     st.markdown("Assign importance to each criterion (0–5 scale):")
     
                     weights = []
-                    cols = st.columns(len(available_criteria))
-                    for i, (col, direction) in enumerate(available_criteria.items()):
+                    cols = st.columns(len(criteria_cols))
+                    for i, (col, direction) in enumerate(zip(criteria_cols, types_arr)):
                         with cols[i]:
                             weight = st.slider(
                                 f"{col} ({'Max' if direction == 1 else 'Min'})",
@@ -591,33 +716,32 @@ def main():
     
                 # Display weights
                 weights_df = pd.DataFrame({
-                    'Criterion': list(available_criteria.keys()),
+                    'Criterion': criteria_cols,
                     'Weight': weights,
-                    'Direction': ['Maximize' if d == 1 else 'Minimize' for d in available_criteria.values()]
+                    'Direction': ['Maximize' if d == 1 else 'Minimize' for d in types_arr]
                 }).sort_values('Weight', ascending=False)
     
                 st.dataframe(
-                    weights_df.style.format({'Weight': '{:.2%}'}),
+                    weights_df.assign(Weight=[f"{w:.2%}" for w in weights_df['Weight']]),
                     use_container_width=True
                 )
     
                 # Run analysis
                 if st.button("🚀 Run Analysis", type="primary"):
                     with st.spinner("Performing analysis..."):
-                        matrix = filtered_df[list(available_criteria.keys())].values
-                        types = np.array([available_criteria[k] for k in available_criteria])
+                        mat_hash = matrix_fingerprint(matrix, weights)
     
                         if mcdm_method == "TOPSIS":
-                            scores = run_topsis(matrix, weights, types)
-                            ranks = rankdata(scores, reverse=True).astype(int)  # Ensure integer ranks
+                            scores = run_topsis(mat_hash, matrix, weights, types_arr)
+                            ranks = rank_descending(scores)
                             results = pd.DataFrame({
                                 'Material': filtered_df['Name'],
                                 'Score': scores,
                                 'Rank': ranks
                             }).sort_values('Rank')
                         else:
-                            flows = run_promethee(matrix, weights, types)
-                            ranks = rankdata(flows, reverse=True).astype(int)  # Already correctly cast
+                            flows = run_promethee(mat_hash, matrix, weights, types_arr)
+                            ranks = rank_descending(flows)
                             results = pd.DataFrame({
                                 'Material': filtered_df['Name'],
                                 'Net Flow': flows,
@@ -626,14 +750,12 @@ def main():
     
                     # Display results
                     st.subheader("📋 Results")
-                    st.dataframe(
-                        results.style.format({
-                            'Score': '{:.2f}',
-                            'Net Flow': '{:.2f}',
-                            'Rank': '{:.0f}'  # Format rank as integer
-                        }),
-                        use_container_width=True
-                    )
+                    value_col = 'Score' if 'Score' in results.columns else 'Net Flow'
+                    results_disp = results.assign(**{
+                        value_col: np.round(results[value_col].to_numpy(), 2),
+                        'Rank': results['Rank'].to_numpy().astype(np.int32)  # Show rank as integer
+                    })
+                    st.dataframe(results_disp, use_container_width=True)
     
                     # Visualize top materials
                     st.subheader("🏆 Top Materials")